@@ -1,25 +1,60 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from flask_caching import Cache
+from flask_session import Session
+import logging
 import os
 
 db = SQLAlchemy()
+cache = Cache()
 DB_NAME = "Grad_Project_DB"
+DB_URI = "mssql+pyodbc://MELISA\\SQLSERVER/Grad_Project_DB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes"
+MAX_UPLOAD_SIZE = 8 * 1024 * 1024  # 8 MB
 
 
 def create_app():
+    # LOG_LEVEL=DEBUG shows per-request detection and recipe search details
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
     app = Flask(__name__)
     app.config["SECRET_KEY"] = "your_secret_key_here"
+    # Werkzeug rejects larger request bodies with 413 before reading them into memory
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE
 
     # Database configuration
-    app.config["SQLALCHEMY_DATABASE_URI"] = (
-        "mssql+pyodbc://MELISA\\SQLSERVER/Grad_Project_DB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes"
-    )
+    app.config["SQLALCHEMY_DATABASE_URI"] = DB_URI
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SQLALCHEMY_ECHO"] = True  # For debugging SQL queries
 
+    # Short-lived cache for annotated upload images and recipe searches.
+    # Use CACHE_TYPE="RedisCache" with CACHE_REDIS_URL when running several workers.
+    app.config["CACHE_TYPE"] = os.environ.get("CACHE_TYPE", "SimpleCache")
+    app.config["CACHE_REDIS_URL"] = os.environ.get("CACHE_REDIS_URL")
+    app.config["CACHE_DEFAULT_TIMEOUT"] = 60
+
+    # Keep session data (e.g. detected ingredients) server-side; only the session id goes in the cookie.
+    # Set SESSION_REDIS_URL to share sessions between workers, otherwise they are stored on disk.
+    session_redis_url = os.environ.get("SESSION_REDIS_URL")
+    if session_redis_url:
+        import redis
+
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = redis.from_url(session_redis_url)
+    else:
+        from cachelib.file import FileSystemCache
+
+        app.config["SESSION_TYPE"] = "cachelib"
+        # cachelib's default threshold of 500 would silently evict live sessions
+        app.config["SESSION_CACHELIB"] = FileSystemCache(
+            cache_dir=os.path.join(app.instance_path, "flask_session"),
+            threshold=100000,
+        )
+
     # Initialize database
     db.init_app(app)
+    cache.init_app(app)
+    Session(app)
 
     from .views import views
     from .auth import auth
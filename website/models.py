@@ -38,6 +38,9 @@ class Recipe(db.Model):
 
 class Ingredient(db.Model):
     __tablename__ = "Ingredients"
+    __table_args__ = (
+        db.Index("ix_ing_name", "ingr_name", mssql_include=["ingr_id"]),
+    )
     ingr_id = db.Column(db.Integer, primary_key=True)
     ingr_name = db.Column(db.String(255), nullable=False)
     category = db.Column(db.String(255))
@@ -49,6 +52,10 @@ class Ingredient(db.Model):
 
 class RecipeIngredient(db.Model):
     __tablename__ = "Recipe_Ingredient"
+    # Covering index so ingredient lookups seek on ingr_id without a base-table read
+    __table_args__ = (
+        db.Index("ix_ri_ingr_recipe", "ingr_id", mssql_include=["recipe_id"]),
+    )
     recipe_id = db.Column(
         db.Integer, db.ForeignKey("Recipes.recipe_id"), primary_key=True
     )
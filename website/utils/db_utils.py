@@ -1,6 +1,17 @@
+from itertools import groupby
 from .. import db
 from ..models import Recipe, Favorite, RecipeDetail, RecipeIngredient, Ingredient
 
+def create_indexes(engine=None):
+    """Create the lookup indexes declared on the models if they don't exist yet.
+
+    Pass an engine to run outside an app context (no app, views or detector needed).
+    """
+    engine = engine or db.engine
+    for model in (Ingredient, RecipeIngredient):
+        for index in model.__table__.indexes:
+            index.create(engine, checkfirst=True)
+
 def get_recipe_by_id(recipe_id):
     """Get a recipe by its ID."""
     return Recipe.query.filter_by(recipe_id=recipe_id).first()
@@ -53,32 +64,74 @@ def remove_favorite(user_id, recipe_id):
         return True
     return False
 
+def _recipe_to_dict(recipe, ingredients, details):
+    """Build the template-facing dict for a recipe."""
+    return {
+        'id': recipe.recipe_id,
+        'name': recipe.name,
+        'photo': recipe.photo,
+        'time': recipe.time,
+        'servings': recipe.servings,
+        'calories': recipe.calories,
+        'ranking': recipe.ranking,
+        'ingredients': [
+            {
+                'name': ingredient[0],
+                'quantity': ingredient[1],
+                'unit': ingredient[2]
+            } for ingredient in ingredients
+        ],
+        'instructions': [
+            {
+                'step': detail.step_number,
+                'text': detail.instruction_text
+            } for detail in details
+        ]
+    }
+
 def get_recipe_with_details(recipe_id):
     """Get a recipe with all its details, ingredients, and instructions."""
     recipe = Recipe.query.filter_by(recipe_id=recipe_id).first()
     if recipe:
         details = get_recipe_details(recipe_id)
         ingredients = get_recipe_ingredients(recipe_id)
-        return {
-            'id': recipe.recipe_id,
-            'name': recipe.name,
-            'photo': recipe.photo,
-            'time': recipe.time,
-            'servings': recipe.servings,
-            'calories': recipe.calories,
-            'ranking': recipe.ranking,
-            'ingredients': [
-                {
-                    'name': ingredient[0],
-                    'quantity': ingredient[1],
-                    'unit': ingredient[2]
-                } for ingredient in ingredients
-            ],
-            'instructions': [
-                {
-                    'step': detail.step_number,
-                    'text': detail.instruction_text
-                } for detail in details
-            ]
-        }
-    return None 
\ No newline at end of file
+        return _recipe_to_dict(recipe, ingredients, details)
+    return None
+
+def get_user_favorites_with_details(user_id):
+    """Get all favorites for a user with ingredients and instructions, without a query per recipe."""
+    rows = db.session.query(
+        Recipe,
+        Ingredient.ingr_name,
+        RecipeIngredient.quantity,
+        RecipeIngredient.unit
+    ).join(
+        Favorite, Favorite.recipe_id == Recipe.recipe_id
+    ).outerjoin(
+        RecipeIngredient, RecipeIngredient.recipe_id == Recipe.recipe_id
+    ).outerjoin(
+        Ingredient, Ingredient.ingr_id == RecipeIngredient.ingr_id
+    ).filter(
+        Favorite.user_id == user_id
+    ).order_by(
+        Recipe.recipe_id
+    ).all()
+
+    if not rows:
+        return []
+
+    # Instructions are fetched separately so they don't multiply the ingredient rows
+    recipe_ids = {row[0].recipe_id for row in rows}
+    details_by_recipe = {}
+    for detail in RecipeDetail.query.filter(
+        RecipeDetail.recipe_id.in_(recipe_ids)
+    ).order_by(RecipeDetail.recipe_id, RecipeDetail.step_number):
+        details_by_recipe.setdefault(detail.recipe_id, []).append(detail)
+
+    recipes = []
+    for recipe, group in groupby(rows, key=lambda row: row[0]):
+        ingredients = [row[1:] for row in group if row[1] is not None]
+        recipes.append(
+            _recipe_to_dict(recipe, ingredients, details_by_recipe.get(recipe.recipe_id, []))
+        )
+    return recipes
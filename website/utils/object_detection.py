@@ -1,7 +1,37 @@
 from ultralytics import YOLO
 import cv2
+import io
+import logging
 import numpy as np
 import os
+import queue
+import threading
+import time
+import torch
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from PIL import Image
+
+# PyTurboJPEG decodes JPEGs straight into a numpy array; fall back to OpenCV when
+# the package or the native libturbojpeg library is missing.
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+
+    jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    jpeg = None
+
+logger = logging.getLogger(__name__)
+
+EXIF_ORIENTATION = 0x0112
+
+
+def _exif_orientation(image_bytes):
+    """Read the EXIF orientation tag without decoding the pixels (1 means upright)."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return 1
 
 
 class DetectionResult:
@@ -15,109 +45,168 @@ class DetectionResult:
 
 
 class ObjectDetector:
-    def __init__(self, model_path=None):
-        """Initialize YOLO model."""
+    def __init__(self, model_path=None, max_batch_size=4, batch_window=0.005, timeout=30):
+        """Initialize YOLO model and the worker thread that batches inference requests."""
         if model_path is None:
             model_path = "C:/Users/Monster/Desktop/best.pt_dosyası/best.pt"
 
-        print(f"Loading YOLO model from: {model_path}")
-        self.model = YOLO(model_path)
-        self.device = "cpu"
-        print("YOLO model loaded successfully")
-
-    def detect_ingredients(self, image_bytes):
-        """Detect ingredients in an image."""
-        try:
-            # Create temp directory if it doesn't exist
-            temp_dir = "temp"
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-
-            # Save temporary image for YOLO prediction
-            temp_path = os.path.join(temp_dir, "temp_image.jpg")
-
-            # Convert bytes to file
-            with open(temp_path, "wb") as f:
-                f.write(image_bytes)
-
-            # Get detections
-            results = self.model.predict(
-                source=temp_path, save=False, device=self.device
-            )
-
-            # Process results
-            detections = []
-            for r in results:
-                for box in r.boxes:
-                    class_id = int(box.cls[0])
-                    coordinates = box.xywh[0].tolist()
-                    confidence = float(box.conf[0])
-
-                    detections.append(
-                        {
-                            "class": class_id,
-                            "confidence": confidence,
-                            "bbox": coordinates,
-                        }
-                    )
-
-            print(f"Found {len(detections)} detections")
-            return detections
-
-        except Exception as e:
-            print(f"Error in detect_ingredients: {str(e)}")
-            raise
-
-        finally:
-            # Clean up temporary file
+        self.device = "0" if torch.cuda.is_available() else "cpu"
+        # TensorRT engines are built with a static (1, 3, 640, 640) profile and always get that
+        # shape. With .pt weights ultralytics letterboxes to the smallest 32-multiple rectangle
+        # within 640 when all images in a batch share a shape, so inputs there are not fixed.
+        self.imgsz = 640
+        self.is_engine = False
+        self.model = self._load_model(model_path)
+        logger.info("YOLO model loaded successfully")
+
+        # Concurrent requests arriving within batch_window seconds share one model call.
+        # TensorRT engines are built with a static batch of 1, so they run unbatched.
+        self.max_batch_size = 1 if self.is_engine else max_batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run_batches, name="detector-worker", daemon=True
+        )
+        self._worker.start()
+
+    def _load_model(self, model_path):
+        """Load a serialized TensorRT engine when running on GPU, building it once if requested."""
+        if self.device != "cpu":
+            engine_path = os.path.splitext(model_path)[0] + ".engine"
+
+            # Set DETECTOR_BUILD_ENGINE=1 to export the weights to a TensorRT engine on first start.
+            # DETECTOR_INT8_DATA points at a dataset yaml used for INT8 calibration; FP16 otherwise.
+            if not os.path.exists(engine_path) and os.environ.get("DETECTOR_BUILD_ENGINE") == "1":
+                int8_data = os.environ.get("DETECTOR_INT8_DATA")
+                logger.info("Building TensorRT engine from: %s", model_path)
+                export_args = {
+                    "format": "engine",
+                    "imgsz": self.imgsz,
+                    "batch": 1,
+                    "dynamic": False,
+                    "device": self.device,
+                }
+                if int8_data:
+                    export_args.update(int8=True, data=int8_data)
+                else:
+                    export_args.update(half=True)
+                engine_path = YOLO(model_path).export(**export_args)
+
+            if os.path.exists(engine_path):
+                logger.info("Loading TensorRT engine from: %s", engine_path)
+                self.is_engine = True
+                return YOLO(engine_path, task="detect")
+
+        logger.info("Loading YOLO model from: %s", model_path)
+        return YOLO(model_path)
+
+    def warmup(self, iterations=3):
+        """Run a few inferences on a blank image so the first request doesn't pay the cold-start cost."""
+        dummy_image = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for _ in range(iterations):
+            self._predict(dummy_image)
+        logger.info("YOLO model warmed up with %d iterations", iterations)
+
+    def decode_image(self, image_bytes):
+        """Decode uploaded image bytes into a BGR array in memory."""
+        # TurboJPEG ignores EXIF orientation, so rotated photos go through OpenCV which applies it
+        if (
+            jpeg is not None
+            and image_bytes[:2] == b"\xff\xd8"
+            and _exif_orientation(image_bytes) == 1
+        ):
+            try:
+                return jpeg.decode(image_bytes, pixel_format=TJPF_BGR)
+            except OSError:
+                pass  # Corrupt or unusual JPEG, let OpenCV try
+
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image")
+        return image
+
+    def _as_array(self, image):
+        """Accept either raw image bytes or an already decoded array."""
+        if isinstance(image, (bytes, bytearray)):
+            return self.decode_image(image)
+        return image
+
+    def _run_batches(self):
+        """Worker loop: collect queued images into a batch and run the model once for all of them."""
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Skip requests whose caller already gave up waiting
+            batch = [
+                (image, future)
+                for image, future in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            images = [image for image, _ in batch]
             try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                if os.path.exists(temp_dir) and not os.listdir(temp_dir):
-                    os.rmdir(temp_dir)
+                results = self.model.predict(
+                    source=images,
+                    save=False,
+                    device=self.device,
+                    imgsz=self.imgsz,
+                    verbose=False,
+                )
             except Exception as e:
-                print(f"Error cleaning up temporary files: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
 
-    def detect_and_draw(self, image_bytes):
-        """Detect objects and draw bounding boxes on the image."""
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _predict(self, image):
+        """Queue a single image for the worker and wait for its result."""
+        future = Future()
+        self._requests.put((image, future))
         try:
-            # Create temp directory if it doesn't exist
-            temp_dir = "temp"
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-
-            # Save temporary image for YOLO prediction
-            temp_path = os.path.join(temp_dir, "temp_image.jpg")
-
-            # Convert bytes to file
-            with open(temp_path, "wb") as f:
-                f.write(image_bytes)
-
-            # Run inference and get results with boxes drawn
-            results = self.model.predict(
-                source=temp_path, save=False, device=self.device
-            )
-
-            # Get the plotted image with boxes
-            for r in results:
-                plotted_img = r.plot()
-                # Convert to bytes
-                is_success, buffer = cv2.imencode(".jpg", plotted_img)
-                if is_success:
-                    return buffer.tobytes()
-
-            return image_bytes
-
-        except Exception as e:
-            print(f"Error in detect_and_draw: {str(e)}")
-            raise
-
-        finally:
-            # Clean up temporary file
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                if os.path.exists(temp_dir) and not os.listdir(temp_dir):
-                    os.rmdir(temp_dir)
-            except Exception as e:
-                print(f"Error cleaning up temporary files: {str(e)}")
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Detection timed out after {self.timeout} seconds")
+
+    def detect(self, image):
+        """Detect ingredients in an image and draw their bounding boxes, using a single model call.
+
+        Returns (detections, annotated_bytes). detections is a dict of parallel arrays:
+        "class" (N,), "confidence" (N,) and "bbox" (N, 4) in xywh. annotated_bytes is a JPEG.
+        """
+        image = self._as_array(image)
+
+        # Get detections
+        result = self._predict(image)
+
+        # Pull boxes out as whole arrays instead of indexing tensors per box
+        boxes = result.boxes.cpu().numpy()
+        detections = {
+            "class": boxes.cls.astype(int),
+            "confidence": boxes.conf,
+            "bbox": boxes.xywh,
+        }
+        logger.debug("Found %d detections", len(detections["class"]))
+
+        # Draw the boxes from the same result instead of running the model again
+        is_success, buffer = cv2.imencode(
+            ".jpg", result.plot(), [int(cv2.IMWRITE_JPEG_QUALITY), 85]
+        )
+        if not is_success:
+            raise ValueError("Could not encode annotated image")
+
+        return detections, buffer.tobytes()
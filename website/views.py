@@ -11,27 +11,38 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from .models import Recipe, Ingredient, Favorite, RecipeIngredient
-from . import db
+from . import db, cache, MAX_UPLOAD_SIZE
 from .utils.db_utils import (
     get_recipe_by_id,
     get_recipes_by_ingredient,
-    get_recipe_with_details,
     add_favorite,
     remove_favorite,
-    get_user_favorites,
+    get_user_favorites_with_details,
 )
+import hashlib
 import json
+import logging
 import os
+import uuid
+from types import MappingProxyType
+import numpy as np
+from sqlalchemy import text, bindparam
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from PIL import Image
 import io
 from .utils.object_detection import ObjectDetector
 
 views = Blueprint("views", __name__)
+logger = logging.getLogger(__name__)
 detector = ObjectDetector()
 
+# Set SKIP_DETECTOR_WARMUP=1 to skip warmup (e.g. when running tests)
+if os.environ.get("SKIP_DETECTOR_WARMUP") != "1":
+    detector.warmup()
+
 # Map YOLO class IDs to ingredient names
-INGREDIENT_MAP = {
+INGREDIENT_MAP = MappingProxyType({
     0: "aubergine",
     1: "cabbage",
     2: "carrot",
@@ -42,7 +53,15 @@ INGREDIENT_MAP = {
     7: "patato",
     8: "spinach",
     9: "tomato",
-}
+})
+
+# Reverse lookup used to validate ingredient names sent by the client
+INGREDIENT_NAME_TO_ID = MappingProxyType(
+    {name: class_id for class_id, name in INGREDIENT_MAP.items()}
+)
+
+# Annotated images stay cached server-side as long as browsers may keep them
+ANNOTATED_IMAGE_TIMEOUT = 300
 
 
 @views.route("/", methods=["GET"])
@@ -52,6 +71,9 @@ def home():
 
 @views.route("/upload-image", methods=["POST"])
 def upload_image():
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_SIZE:
+        return _upload_too_large()
+
     if "image" not in request.files:
         return jsonify({"error": "No image uploaded"}), 400
 
@@ -61,57 +83,41 @@ def upload_image():
 
     if file:
         try:
-            image_bytes = file.read()
+            # Read at most one byte past the limit so oversized streams are caught without buffering them
+            image_bytes = file.stream.read(MAX_UPLOAD_SIZE + 1)
+            if len(image_bytes) > MAX_UPLOAD_SIZE:
+                return _upload_too_large()
 
             try:
-                detections = detector.detect_ingredients(image_bytes)
-                print(f"Detections: {detections}")
-                class_ids_list = [int(d["class"]) for d in detections]
-
-            except Exception as e:
-                print(f"Error in detect_ingredients: {str(e)}")
-                import traceback
-
-                print(f"Traceback: {traceback.format_exc()}")
-                return jsonify({"error": f"Error detecting ingredients: {str(e)}"}), 500
+                image = detector.decode_image(image_bytes)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
             try:
-                annotated_image = detector.detect_and_draw(image_bytes)
-                print("Annotated image received")
+                detections, annotated_image = detector.detect(image)
+                logger.debug("Detections: %s", detections)
+
             except Exception as e:
-                print(f"Error in detect_and_draw: {str(e)}")
-                import traceback
+                logger.exception("Error in detect")
+                return jsonify({"error": f"Error detecting ingredients: {str(e)}"}), 500
 
-                print(f"Traceback: {traceback.format_exc()}")
-                return (
-                    jsonify({"error": f"Error creating annotated image: {str(e)}"}),
-                    500,
-                )
+            # Keep the first (highest confidence) detection for each class
+            class_ids = detections["class"]
+            _, first_indices = np.unique(class_ids, return_index=True)
+            first_indices.sort()
 
             detected_ingredients = []
-            for class_id in class_ids_list:
-                if class_id in INGREDIENT_MAP:
-                    detected_ingredients.append(
-                        {
-                            "name": INGREDIENT_MAP[class_id],
-                            "confidence": next(
-                                (
-                                    d["confidence"]
-                                    for d in detections
-                                    if d["class"] == class_id
-                                ),
-                                0.0,
-                            ),
-                            "bbox": next(
-                                (
-                                    d["bbox"]
-                                    for d in detections
-                                    if d["class"] == class_id
-                                ),
-                                [],
-                            ),
-                        }
-                    )
+            for i in first_indices:
+                name = INGREDIENT_MAP.get(int(class_ids[i]))
+                if name is None:
+                    continue
+                detected_ingredients.append(
+                    {
+                        "name": name,
+                        "confidence": float(detections["confidence"][i]),
+                        "bbox": detections["bbox"][i].tolist(),
+                    }
+                )
 
             if not detected_ingredients:
                 return jsonify({"error": "No ingredients detected"}), 400
@@ -120,79 +126,125 @@ def upload_image():
                 ing["name"] for ing in detected_ingredients
             ]
 
+            # Serve the annotated image from its own route instead of inlining it in JSON
+            annotated_key = uuid.uuid4().hex
+            cache.set(
+                f"annotated:{annotated_key}",
+                annotated_image,
+                timeout=ANNOTATED_IMAGE_TIMEOUT,
+            )
+
             return jsonify(
                 {
                     "success": True,
                     "ingredients": detected_ingredients,
-                    "annotated_image": annotated_image.decode("latin1"),
+                    "annotated_url": url_for("views.annotated", key=annotated_key),
                 }
             )
 
         except Exception as e:
-            print(f"Error processing image: {str(e)}")
-            import traceback
-
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error processing image")
             return jsonify({"error": str(e)}), 500
 
     return jsonify({"error": "Invalid image file"}), 400
 
 
-from sqlalchemy import text
+def _upload_too_large():
+    limit_mb = MAX_UPLOAD_SIZE // (1024 * 1024)
+    return jsonify({"error": f"Image is too large (max {limit_mb} MB)"}), 413
+
+
+@views.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    return _upload_too_large()
+
+
+@views.route("/annotated/<key>", methods=["GET"])
+def annotated(key):
+    annotated_image = cache.get(f"annotated:{key}")
+    if annotated_image is None:
+        return jsonify({"error": "Annotated image not found or expired"}), 404
+
+    response = send_file(io.BytesIO(annotated_image), mimetype="image/jpeg")
+    response.headers["Cache-Control"] = f"private, max-age={ANNOTATED_IMAGE_TIMEOUT}"
+    response.set_etag(hashlib.blake2b(annotated_image, digest_size=16).hexdigest())
+    return response.make_conditional(request)
+
+
+# Recipe search results are cached per ingredient set for this many seconds
+RECIPE_CACHE_TIMEOUT = 300
 
+RECIPES_PER_PAGE = 20
+MAX_RECIPES_PER_PAGE = 100
 
-def find_recipes_by_ingredients(ingredients):
-    """Find recipes based on detected ingredients."""
+
+def find_recipes_by_ingredients(ingredients, page=1, per_page=RECIPES_PER_PAGE):
+    """Find one page of recipes based on detected ingredients.
+
+    Returns (recipe_list, has_next).
+    """
     try:
-        print(f"Searching for recipes with ingredients: {ingredients}")
+        logger.debug(
+            "Searching for recipes with ingredients: %s (page %d)", ingredients, page
+        )
 
-        ingredient_names = ", ".join(f"'{ingredient}'" for ingredient in ingredients)
-        query = f"""
+        # The same ingredient set in any order maps to the same cache entry
+        cache_key = f"recipes:{page}:{per_page}:" + ",".join(sorted(set(ingredients)))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        query = text(
+            """
         WITH UserIngredients AS (
             SELECT ingr_id 
             FROM dbo.Ingredients 
-            WHERE ingr_name IN ({ingredient_names})
+            WHERE ingr_name IN :names
         )
         SELECT r.recipe_id, r.name, COUNT(ri.ingr_id) AS match_count, r.time, r.calories
         FROM dbo.Recipes r
         JOIN dbo.Recipe_Ingredient ri ON r.recipe_id = ri.recipe_id
         JOIN UserIngredients ui ON ri.ingr_id = ui.ingr_id
         GROUP BY r.recipe_id, r.name, r.time, r.calories
-        ORDER BY match_count DESC, r.time ASC, r.calories ASC;
+        ORDER BY match_count DESC, r.time ASC, r.calories ASC, r.recipe_id ASC
+        OFFSET :offset ROWS FETCH NEXT :limit ROWS ONLY;
         """
-
-        result = db.session.execute(text(query)).fetchall()
-        recipe_list = []
-
-        for row in result:
-            recipe_list.append(
-                {
-                    "recipe_id": row.recipe_id,
-                    "name": row.name,
-                    "match_count": row.match_count,
-                    "time": row.time,
-                    "calories": row.calories,
-                }
-            )
-
-        print(f"Found {len(recipe_list)} unique recipes")
-        return recipe_list
-
-    except Exception as e:
-        print(f"Error fetching recipes: {e}")
-        import traceback
-
-        print(f"Traceback: {traceback.format_exc()}")
-        return []
+        ).bindparams(bindparam("names", expanding=True))
+
+        # Fetch one extra row to tell whether another page exists
+        result = db.session.execute(
+            query,
+            {
+                "names": tuple(ingredients),
+                "offset": (page - 1) * per_page,
+                "limit": per_page + 1,
+            },
+        ).fetchall()
+        has_next = len(result) > per_page
+        recipe_list = [
+            {
+                "recipe_id": row.recipe_id,
+                "name": row.name,
+                "match_count": row.match_count,
+                "time": row.time,
+                "calories": row.calories,
+            }
+            for row in result[:per_page]
+        ]
+
+        logger.debug("Found %d unique recipes", len(recipe_list))
+        cache.set(cache_key, (recipe_list, has_next), timeout=RECIPE_CACHE_TIMEOUT)
+        return recipe_list, has_next
+
+    except Exception:
+        logger.exception("Error fetching recipes")
+        return [], False
 
 
 @views.route("/favorites", methods=["GET"])
 @login_required
 def favorites():
-    favorite_recipes = get_user_favorites(current_user.user_id)
-    recipes_with_details = [
-        get_recipe_with_details(recipe.recipe_id) for recipe in favorite_recipes
-    ]
+    recipes_with_details = get_user_favorites_with_details(current_user.user_id)
     return render_template(
         "favorites.html", user=current_user, recipes=recipes_with_details
     )
@@ -230,12 +282,34 @@ def recipes():
         flash("No ingredients detected. Please upload an image first.", "error")
         return redirect(url_for("views.home"))
 
-    recipes = find_recipes_by_ingredients(detected_ingredients)
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(
+        max(request.args.get("per_page", RECIPES_PER_PAGE, type=int), 1),
+        MAX_RECIPES_PER_PAGE,
+    )
+
+    recipes, has_next = find_recipes_by_ingredients(
+        detected_ingredients, page=page, per_page=per_page
+    )
+
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "recipes": recipes,
+                "page": page,
+                "per_page": per_page,
+                "has_next": has_next,
+            }
+        )
+
     return render_template(
         "recipe_results.html",
         user=current_user,
         ingredients=detected_ingredients,
         recipes=recipes,
+        page=page,
+        per_page=per_page,
+        has_next=has_next,
     )
 
 
@@ -248,20 +322,54 @@ def all_ingredients():
 @views.route("/add-ingredient", methods=["POST"])
 def add_ingredient():
     try:
-        data = request.get_json()
-        ingredient = data.get("ingredient")
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "Invalid request body"}), 400
+
+        # Accept a single "ingredient" or a list of "ingredients" in one request
+        ingredients = data.get("ingredients")
+        if ingredients is None:
+            ingredients = [data.get("ingredient")] if data.get("ingredient") else []
+
+        if not isinstance(ingredients, list) or not all(
+            isinstance(ingredient, str) for ingredient in ingredients
+        ):
+            return (
+                jsonify(
+                    {"success": False, "error": "Ingredients must be a list of names"}
+                ),
+                400,
+            )
+        ingredients = [ingredient for ingredient in ingredients if ingredient]
 
-        if not ingredient:
+        if not ingredients:
             return jsonify({"success": False, "error": "No ingredient specified"}), 400
 
+        unknown = [i for i in ingredients if i not in INGREDIENT_NAME_TO_ID]
+        if unknown:
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": f"Unknown ingredient: {', '.join(unknown)}",
+                    }
+                ),
+                400,
+            )
+
         current_ingredients = session.get("detected_ingredients", [])
+        seen = set(current_ingredients)
+        new_ingredients = []
+        for ingredient in ingredients:
+            if ingredient not in seen:
+                seen.add(ingredient)
+                new_ingredients.append(ingredient)
 
-        if ingredient not in current_ingredients:
-            current_ingredients.append(ingredient)
-            session["detected_ingredients"] = current_ingredients
+        if new_ingredients:
+            session["detected_ingredients"] = current_ingredients + new_ingredients
 
         return jsonify({"success": True})
 
     except Exception as e:
-        print(f"Error adding ingredient: {str(e)}")
+        logger.exception("Error adding ingredient")
         return jsonify({"success": False, "error": str(e)}), 500